@@ -1,20 +1,41 @@
 # Copyright (c) Kuba Szczodrzyński 2023-12-27.
 
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.const import Platform
+from homeassistant.const import CONF_ENTITIES, Platform
 from homeassistant.core import HomeAssistant
 
+from .device_store import DeviceStore
 from .entry_class import IntegrationEntryClass
 from .mixin.entity import EntityMixin
 
 PLATFORMS = [
     Platform.SWITCH,
     Platform.BUTTON,
+    Platform.BINARY_SENSOR,
 ]
 
 VirtualEntity = EntityMixin
 
 
+async def async_migrate_entry(hass: HomeAssistant, config_entry: ConfigEntry) -> bool:
+    if config_entry.version > 2:
+        # downgraded from a future version
+        return False
+    if config_entry.version == 1:
+        # move entity definitions to the device's own store; the options
+        # held a stale copy of the entry data, entities included
+        data = dict(config_entry.data)
+        store = await DeviceStore.async_get(hass, config_entry.entry_id)
+        await store.async_save_entities(data.pop(CONF_ENTITIES, None) or [])
+        hass.config_entries.async_update_entry(
+            entry=config_entry,
+            data=data,
+            options={},
+            version=2,
+        )
+    return True
+
+
 async def async_setup_entry(hass: HomeAssistant, config_entry: ConfigEntry) -> bool:
     return await IntegrationEntryClass(hass, config_entry).setup()
 
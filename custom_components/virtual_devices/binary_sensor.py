@@ -0,0 +1,19 @@
+#  Copyright (c) Kuba Szczodrzyński 2024-1-16.
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import Platform
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+
+from .entity_class import IntegrationEntityClass
+
+
+async def async_setup_entry(
+    hass: HomeAssistant,
+    config_entry: ConfigEntry,
+    async_add_entities: AddEntitiesCallback,
+) -> None:
+    await IntegrationEntityClass(hass, config_entry).setup(
+        platform=Platform.BINARY_SENSOR,
+        async_add_entities=async_add_entities,
+    )
@@ -1,10 +1,12 @@
 # Copyright (c) Kuba Szczodrzyński 2023-12-27.
 
 from copy import deepcopy
+from time import time
 from typing import Any
 
 import homeassistant.helpers.config_validation as cv
 import voluptuous as vol
+from homeassistant.components.binary_sensor import BinarySensorDeviceClass
 from homeassistant.components.button import ButtonDeviceClass
 from homeassistant.components.cover import CoverDeviceClass
 from homeassistant.components.number import NumberDeviceClass
@@ -19,7 +21,7 @@ from homeassistant.config_entries import (
 from homeassistant.const import (
     CONF_COUNT,
     CONF_DEVICE_CLASS,
-    CONF_ENTITIES,
+    CONF_DURATION,
     CONF_FRIENDLY_NAME,
     CONF_ID,
     CONF_MODEL,
@@ -35,7 +37,17 @@ from homeassistant.helpers.selector import (
 from homeassistant.util.uuid import random_uuid_hex
 from voluptuous import default_factory
 
-from .const import CONF_DATA, CONF_MANUFACTURER, CONF_MODULE, DOMAIN
+from .const import (
+    CONF_DATA,
+    CONF_END,
+    CONF_MANUFACTURER,
+    CONF_MODULE,
+    CONF_MODULES,
+    CONF_PROFILE,
+    DOMAIN,
+)
+from .device_store import DeviceStore
+from .mixin.gpio import GPIO_DEFAULT_COMPENSATION_US, GpioMixin
 from .mixin.reload import ReloadMixin
 from .mixin.storage import StorageMixin
 
@@ -44,6 +56,8 @@ DEVICE_OPTIONS_MENU = [
     "entity_copy",
     "entity_edit",
     "entity_remove",
+    "device_profile",
+    "gpio_calibrate",
 ]
 
 
@@ -52,7 +66,7 @@ class DeviceConfigFlow(
     ReloadMixin,
     domain=DOMAIN,
 ):
-    VERSION = 1
+    VERSION = 2
     MINOR_VERSION = 1
 
     @staticmethod
@@ -69,7 +83,6 @@ class DeviceConfigFlow(
                 data={
                     CONF_MANUFACTURER: user_input[CONF_MANUFACTURER],
                     CONF_MODEL: user_input[CONF_MODEL],
-                    CONF_ENTITIES: [],
                 },
             )
 
@@ -102,6 +115,8 @@ class DeviceOptionsFlow(
     def __init__(self, config_entry: ConfigEntry) -> None:
         self.config_entry = config_entry
         self.entry_data = deepcopy(dict(self.config_entry.data))
+        self.store: DeviceStore | None = None
+        self.entities: list[dict] = []
         self.entity_data = None
         self.entity_index = 1
         self.entity_count = 1
@@ -110,7 +125,14 @@ class DeviceOptionsFlow(
         self,
         user_input: dict[str, Any] | None = None,
     ) -> FlowResult:
-        if not self.entry_data.get(CONF_ENTITIES, None):
+        if self.store is None:
+            self.store = await DeviceStore.async_get(
+                self.hass,
+                self.config_entry.entry_id,
+            )
+            self.entities = deepcopy(self.store.entities)
+
+        if not self.entities:
             return await self.async_step_entity_add(user_input)
 
         return self.async_show_menu(
@@ -163,9 +185,7 @@ class DeviceOptionsFlow(
         user_input: dict[str, Any] | None = None,
     ) -> FlowResult:
         if user_input:
-            entities = {
-                entity[CONF_ID]: entity for entity in self.entry_data[CONF_ENTITIES]
-            }
+            entities = {entity[CONF_ID]: entity for entity in self.entities}
             self.entity_data = deepcopy(entities[user_input[CONF_ID]])
             self.entity_data[CONF_ID] = random_uuid_hex()
             self.entity_index = 1
@@ -173,7 +193,7 @@ class DeviceOptionsFlow(
             return await self.async_step_entity_editor()
 
         entities = {}
-        for entity in self.entry_data[CONF_ENTITIES]:
+        for entity in self.entities:
             value = f"{entity[CONF_FRIENDLY_NAME]} ({entity[CONF_PLATFORM].title()})"
             entities[entity[CONF_ID]] = value
 
@@ -198,16 +218,14 @@ class DeviceOptionsFlow(
         user_input: dict[str, Any] | None = None,
     ) -> FlowResult:
         if user_input:
-            entities = {
-                entity[CONF_ID]: entity for entity in self.entry_data[CONF_ENTITIES]
-            }
+            entities = {entity[CONF_ID]: entity for entity in self.entities}
             self.entity_data = entities[user_input[CONF_ID]]
             self.entity_index = 1
             self.entity_count = 1
             return await self.async_step_entity_editor()
 
         entities = {}
-        for entity in self.entry_data[CONF_ENTITIES]:
+        for entity in self.entities:
             value = f"{entity[CONF_FRIENDLY_NAME]} ({entity[CONF_PLATFORM].title()})"
             entities[entity[CONF_ID]] = value
 
@@ -225,13 +243,13 @@ class DeviceOptionsFlow(
         user_input: dict[str, Any] | None = None,
     ) -> FlowResult:
         if user_input:
-            for entity in list(self.entry_data[CONF_ENTITIES]):
+            for entity in list(self.entities):
                 if entity[CONF_ID] == user_input[CONF_ID]:
-                    self.entry_data[CONF_ENTITIES].remove(entity)
-            return await self._async_update_entry_data(self.entry_data)
+                    self.entities.remove(entity)
+            return await self._async_update_entities(self.entities)
 
         entities = {}
-        for entity in self.entry_data[CONF_ENTITIES]:
+        for entity in self.entities:
             value = f"{entity[CONF_FRIENDLY_NAME]} ({entity[CONF_PLATFORM].title()})"
             entities[entity[CONF_ID]] = value
 
@@ -244,17 +262,138 @@ class DeviceOptionsFlow(
             ),
         )
 
+    async def async_step_device_profile(
+        self,
+        user_input: dict[str, Any] | None = None,
+    ) -> FlowResult:
+        if user_input:
+            self.entry_data[CONF_PROFILE] = {
+                CONF_MODULES: user_input[CONF_MODULES],
+                CONF_DURATION: int(user_input[CONF_DURATION]),
+                # absolute, so that reloads and restarts don't extend the window
+                CONF_END: time() + int(user_input[CONF_DURATION]),
+            }
+            return await self._async_update_entry_data(self.entry_data)
+
+        profile = self.entry_data.get(CONF_PROFILE, None) or {}
+        modules = sorted(set(entity[CONF_MODULE] for entity in self.entities))
+
+        return self.async_show_form(
+            step_id="device_profile",
+            data_schema=vol.Schema(
+                {
+                    vol.Optional(
+                        CONF_MODULES,
+                        default=profile.get(CONF_MODULES, []),
+                    ): cv.multi_select(modules),
+                    vol.Required(
+                        CONF_DURATION,
+                        default=profile.get(CONF_DURATION, 0),
+                    ): NumberSelector(
+                        dict(
+                            min=0,
+                            max=86400,
+                            mode=NumberSelectorMode.BOX,
+                            unit_of_measurement="s",
+                        ),
+                    ),
+                }
+            ),
+        )
+
+    async def async_step_gpio_calibrate(
+        self,
+        user_input: dict[str, Any] | None = None,
+    ) -> FlowResult:
+        entities = {}
+        for entity in self.entities:
+            if "gpiochip" not in entity[CONF_DATA]:
+                continue
+            value = f"{entity[CONF_FRIENDLY_NAME]} ({entity[CONF_PLATFORM].title()})"
+            entities[entity[CONF_ID]] = value
+        if not entities:
+            return self.async_abort(reason="no_gpio")
+
+        errors = {}
+        error = ""
+        if user_input:
+            for entity in self.entities:
+                if entity[CONF_ID] == user_input[CONF_ID]:
+                    break
+            gpio = GpioMixin()
+            gpio.hass = self.hass
+            gpio.hass_data = self.hass.data.setdefault(DOMAIN, {})
+            gpio.data = entity[CONF_DATA]
+            if gpio._gpio_key not in gpio.hass_data:
+                # only calibrate lines already held by their entities
+                errors["base"] = "gpio_not_open"
+            else:
+                try:
+                    calibration = await self.hass.async_add_executor_job(
+                        gpio._gpio_calibrate,
+                    )
+                except Exception as e:
+                    errors["base"] = "calibration_failed"
+                    error = str(e)
+            if not errors:
+                gpiochip = entity[CONF_DATA]["gpiochip"]
+                GpioMixin.async_save_calibration(self.hass, gpiochip, calibration)
+                if calibration["loopback"]:
+                    result = (
+                        f"pulse width error {calibration['error_us']:.2f} us "
+                        f"(max. {calibration['max_error_us']:.2f} us)"
+                    )
+                    compensation = f"{calibration['compensation_us']:.2f} us"
+                else:
+                    result = (
+                        f"loop jitter {calibration['loop_error_us']:.2f} us "
+                        f"(max. {calibration['loop_max_error_us']:.2f} us), "
+                        f"pulse widths not measured - no loopback line"
+                    )
+                    compensation = f"{GPIO_DEFAULT_COMPENSATION_US} us (default)"
+                return self.async_abort(
+                    reason="gpio_calibrated",
+                    description_placeholders=dict(
+                        gpiochip=gpiochip,
+                        write=f"{calibration['write_us']:.2f}",
+                        compensation=compensation,
+                        result=result,
+                    ),
+                )
+
+        return self.async_show_form(
+            step_id="gpio_calibrate",
+            data_schema=vol.Schema(
+                {
+                    vol.Required(CONF_ID): vol.In(entities),
+                }
+            ),
+            errors=errors,
+            description_placeholders=dict(error=error),
+        )
+
     async def async_step_entity_editor(
         self,
         user_input: dict[str, Any] | None = None,
     ) -> FlowResult:
+        errors = {}
+        error = ""
         if user_input:
+            module = self.get_entity_module(self.entity_data[CONF_MODULE])
+            entity_class = module.PLATFORMS[self.entity_data[CONF_PLATFORM]]
+            try:
+                entity_class.validate_config(user_input)
+            except vol.Invalid as e:
+                errors["base"] = "invalid_config"
+                error = str(e)
+
+        if user_input and not errors:
             # self.entity_data[CONF_ID] = user_input.pop(CONF_ID)
             self.entity_data[CONF_DEVICE_CLASS] = user_input.pop(CONF_DEVICE_CLASS)
             self.entity_data[CONF_FRIENDLY_NAME] = user_input.pop(CONF_FRIENDLY_NAME)
             self.entity_data[CONF_DATA] |= user_input
 
-            entities: list = self.entry_data[CONF_ENTITIES]
+            entities: list = self.entities
             if self.entity_data not in entities:
                 entities.append(self.entity_data)
 
@@ -264,7 +403,7 @@ class DeviceOptionsFlow(
                 self.entity_index += 1
                 return await self.async_step_entity_editor()
 
-            return await self._async_update_entry_data(self.entry_data)
+            return await self._async_update_entities(self.entities)
 
         data_schema = {
             # vol.Required(
@@ -282,6 +421,7 @@ class DeviceOptionsFlow(
         data: dict = self.entity_data[CONF_DATA]
 
         device_classes = {
+            Platform.BINARY_SENSOR: BinarySensorDeviceClass,
             Platform.SWITCH: SwitchDeviceClass,
             Platform.BUTTON: ButtonDeviceClass,
             Platform.COVER: CoverDeviceClass,
@@ -316,10 +456,12 @@ class DeviceOptionsFlow(
             return self.async_show_form(
                 step_id="entity_editor",
                 data_schema=vol.Schema(data_schema),
+                errors=errors,
                 description_placeholders=dict(
                     entity_index=str(self.entity_index),
                     entity_count=str(self.entity_count),
                     module=f"{module.TITLE} ({platform.title()})",
+                    error=error,
                 ),
                 last_step=self.entity_index == self.entity_count,
             )
@@ -334,5 +476,16 @@ class DeviceOptionsFlow(
         )
         return self.async_create_entry(
             title=self.config_entry.title,
-            data=entry_data,
+            data={},
+        )
+
+    async def _async_update_entities(self, entities: list[dict]) -> FlowResult:
+        # only this device's store is rewritten, the config entry is unchanged
+        self.store.async_set_entities(entities)
+        await self.hass.config_entries.async_reload(
+            entry_id=self.config_entry.entry_id,
+        )
+        return self.async_create_entry(
+            title=self.config_entry.title,
+            data={},
         )
@@ -3,5 +3,8 @@
 DOMAIN = "virtual_devices"
 
 CONF_DATA = "data"
+CONF_END = "end"
 CONF_MANUFACTURER = "manufacturer"
 CONF_MODULE = "module"
+CONF_MODULES = "modules"
+CONF_PROFILE = "profile"
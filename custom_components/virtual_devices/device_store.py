@@ -0,0 +1,93 @@
+#  Copyright (c) Kuba Szczodrzyński 2024-1-22.
+
+from copy import deepcopy
+from typing import Any
+
+from homeassistant.const import (
+    CONF_DEVICE_CLASS,
+    CONF_ENTITIES,
+    CONF_FRIENDLY_NAME,
+    CONF_ID,
+    CONF_PLATFORM,
+)
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+
+from .const import CONF_DATA, CONF_MODULE, DOMAIN
+
+STORAGE_VERSION = 1
+STORAGE_MINOR_VERSION = 1
+STORAGE_SAVE_DELAY = 5
+
+# entity keys as written to the store
+STORAGE_KEYS = {
+    CONF_ID: "i",
+    CONF_PLATFORM: "p",
+    CONF_MODULE: "m",
+    CONF_FRIENDLY_NAME: "n",
+    CONF_DEVICE_CLASS: "c",
+    CONF_DATA: "d",
+}
+
+
+class DeviceStore(Store):
+    def __init__(self, hass: HomeAssistant, entry_id: str):
+        super().__init__(
+            hass=hass,
+            version=STORAGE_VERSION,
+            key=f"{DOMAIN}.{entry_id}",
+            minor_version=STORAGE_MINOR_VERSION,
+        )
+        self.entities: list[dict] | None = None
+
+    @staticmethod
+    async def async_get(hass: HomeAssistant, entry_id: str) -> "DeviceStore":
+        hass_data = hass.data.setdefault(DOMAIN, {})
+        key = f"store/{entry_id}"
+        if key not in hass_data:
+            hass_data[key] = DeviceStore(hass, entry_id)
+        store: DeviceStore = hass_data[key]
+        if store.entities is None:
+            data = await store.async_load() or {}
+            store.entities = [
+                store._expand(entity) for entity in data.get(CONF_ENTITIES, [])
+            ]
+        return store
+
+    @staticmethod
+    async def async_delete(hass: HomeAssistant, entry_id: str) -> None:
+        hass_data = hass.data.setdefault(DOMAIN, {})
+        store = hass_data.pop(f"store/{entry_id}", None)
+        if store is None:
+            store = DeviceStore(hass, entry_id)
+        await store.async_remove()
+
+    def async_set_entities(self, entities: list[dict]) -> None:
+        self.entities = deepcopy(entities)
+        self.async_delay_save(self._data_to_save, STORAGE_SAVE_DELAY)
+
+    async def async_save_entities(self, entities: list[dict]) -> None:
+        self.entities = deepcopy(entities)
+        await self.async_save(self._data_to_save())
+
+    def _data_to_save(self) -> dict[str, Any]:
+        return {
+            CONF_ENTITIES: [self._compact(entity) for entity in self.entities or []],
+        }
+
+    @staticmethod
+    def _compact(entity: dict) -> dict:
+        result = {}
+        for key, short in STORAGE_KEYS.items():
+            value = entity.get(key, None)
+            if value is None or key == CONF_DEVICE_CLASS and value == "-":
+                continue
+            result[short] = value
+        return result
+
+    @staticmethod
+    def _expand(entity: dict) -> dict:
+        result = {key: entity.get(short, None) for key, short in STORAGE_KEYS.items()}
+        result[CONF_DEVICE_CLASS] = result[CONF_DEVICE_CLASS] or "-"
+        result[CONF_DATA] = result[CONF_DATA] or {}
+        return result
@@ -0,0 +1,26 @@
+#  Copyright (c) Kuba Szczodrzyński 2024-1-14.
+
+from typing import Any
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_ENTITIES
+from homeassistant.core import HomeAssistant
+
+from .const import CONF_PROFILE, DOMAIN
+from .device_store import DeviceStore
+from .mixin.gpio import GPIO_CALIBRATION_KEY, GPIO_TIMING_KEY
+from .profiler import IntegrationProfiler
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant,
+    config_entry: ConfigEntry,
+) -> dict[str, Any]:
+    store = await DeviceStore.async_get(hass, config_entry.entry_id)
+    return {
+        "entry": config_entry.as_dict(),
+        CONF_ENTITIES: store.entities,
+        CONF_PROFILE: IntegrationProfiler.get(hass, config_entry).as_dict(),
+        "gpio_calibration": hass.data.get(DOMAIN, {}).get(GPIO_CALIBRATION_KEY, None),
+        "gpio_timing": hass.data.get(DOMAIN, {}).get(GPIO_TIMING_KEY, None),
+    }
@@ -7,7 +7,6 @@ from importlib import reload
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import (
     CONF_DEVICE_CLASS,
-    CONF_ENTITIES,
     CONF_FRIENDLY_NAME,
     CONF_ID,
     CONF_MODEL,
@@ -19,8 +18,10 @@ from homeassistant.helpers.device_registry import DeviceInfo
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 
 from .const import CONF_DATA, CONF_MANUFACTURER, CONF_MODULE, DOMAIN
+from .device_store import DeviceStore
 from .mixin.reload import ReloadMixin
 from .mixin.storage import StorageMixin
+from .profiler import IntegrationProfiler
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -50,8 +51,11 @@ class IntegrationEntityClass(StorageMixin, ReloadMixin):
             model=data.get(CONF_MODEL, None),
         )
 
+        store = await DeviceStore.async_get(self.hass, self.config_entry.entry_id)
+        profiler = IntegrationProfiler.get(self.hass, self.config_entry)
+
         entities = []
-        for entity_data in data.get(CONF_ENTITIES, []):
+        for entity_data in store.entities:
             if platform != entity_data[CONF_PLATFORM]:
                 continue
             entity_id = entity_data[CONF_ID]
@@ -66,10 +70,19 @@ class IntegrationEntityClass(StorageMixin, ReloadMixin):
                 for base in entity_class.__bases__:
                     if "virtual_devices" in base.__module__:
                         reload(sys.modules[base.__module__])
-                entity = entity_class(
-                    config_entry=self.config_entry,
-                    data=data,
-                )
+                if profiler.is_enabled(module_name):
+                    entity = profiler.run(
+                        f"{module_name}.__init__",
+                        entity_class,
+                        config_entry=self.config_entry,
+                        data=data,
+                    )
+                    profiler.wrap_entity(module_name, entity)
+                else:
+                    entity = entity_class(
+                        config_entry=self.config_entry,
+                        data=data,
+                    )
             except Exception as e:
                 _LOGGER.error(
                     f"Couldn't load entity module '{module_name}' "
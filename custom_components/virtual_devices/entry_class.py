@@ -4,8 +4,11 @@ from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import Platform
 from homeassistant.core import HomeAssistant
 
+from .device_store import DeviceStore
+from .mixin.gpio import GpioMixin
 from .mixin.reload import ReloadMixin
 from .mixin.storage import StorageMixin
+from .profiler import IntegrationProfiler
 
 
 class IntegrationEntryClass(StorageMixin, ReloadMixin):
@@ -14,11 +17,15 @@ class IntegrationEntryClass(StorageMixin, ReloadMixin):
         self.config_entry = config_entry
 
     async def setup(self) -> bool:
+        IntegrationProfiler.reset(self.hass, self.config_entry)
+        await GpioMixin.async_load_calibration(self.hass)
+
         await self.hass.config_entries.async_forward_entry_setups(
             entry=self.config_entry,
             platforms=[
                 Platform.SWITCH,
                 Platform.BUTTON,
+                Platform.BINARY_SENSOR,
             ],
         )
 
@@ -30,8 +37,10 @@ class IntegrationEntryClass(StorageMixin, ReloadMixin):
             platforms=[
                 Platform.SWITCH,
                 Platform.BUTTON,
+                Platform.BINARY_SENSOR,
             ],
         )
 
     async def remove(self) -> None:
-        pass
+        IntegrationProfiler.remove(self.hass, self.config_entry)
+        await DeviceStore.async_delete(self.hass, self.config_entry.entry_id)
@@ -0,0 +1,381 @@
+#  Copyright (c) Kuba Szczodrzyński 2024-1-16.
+
+import logging
+from pathlib import Path
+from threading import Condition, Event, Lock, Thread
+from time import sleep
+
+import voluptuous as vol
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers.selector import (
+    ConstantSelector,
+    SelectSelector,
+    SelectSelectorMode,
+)
+from periphery import I2C, SPI
+
+_LOGGER = logging.getLogger(__name__)
+
+# time to wait for more requests before running a bus transaction
+BUS_COALESCE_TIME = 0.002
+BUS_SPI_MODE = 0
+BUS_SPI_SPEED = 1_000_000
+BUS_LOCK = Lock()
+
+
+class BusDevice:
+    NAME: str
+    BUS: type
+    BYTES: int = 1
+
+    def __init__(self, address: int, count: int):
+        self.address = address
+        # only shift registers can be chained
+        self.count = count if self.BUS is SPI else 1
+        self.output: int | None = None
+        self.input = 0
+
+    @property
+    def size(self) -> int:
+        return self.BYTES * self.count
+
+    def to_bytes(self, value: int) -> bytes:
+        return value.to_bytes(self.size, "little")
+
+    def from_bytes(self, data) -> int:
+        return int.from_bytes(bytes(data), "little")
+
+    def transact(self, bus, mask: int, value: int, read: bool) -> None:
+        raise NotImplementedError()
+
+
+class Pcf8574(BusDevice):
+    NAME = "PCF8574 (I²C, 8-bit)"
+    BUS = I2C
+
+    def transact(self, bus: I2C, mask: int, value: int, read: bool) -> None:
+        if self.output is None:
+            # quasi-bidirectional pins - read back the current levels
+            message = I2C.Message(bytes(self.size), read=True)
+            bus.transfer(self.address, [message])
+            self.output = self.from_bytes(message.data)
+        messages = []
+        if mask:
+            self.output = (self.output & ~mask) | (value & mask)
+            messages.append(I2C.Message(self.to_bytes(self.output)))
+        if read:
+            messages.append(I2C.Message(bytes(self.size), read=True))
+        if messages:
+            bus.transfer(self.address, messages)
+        if read:
+            self.input = self.from_bytes(messages[-1].data)
+
+
+class Pcf8575(Pcf8574):
+    NAME = "PCF8575 (I²C, 16-bit)"
+    BYTES = 2
+
+
+class Mcp23017(BusDevice):
+    NAME = "MCP23017 (I²C, 16-bit)"
+    BUS = I2C
+    BYTES = 2
+    REG_IODIR = 0x00
+    REG_GPIO = 0x12
+    REG_OLAT = 0x14
+
+    def __init__(self, address: int, count: int):
+        super().__init__(address, count)
+        self.direction = 0xFFFF
+
+    def transact(self, bus: I2C, mask: int, value: int, read: bool) -> None:
+        if self.output is None:
+            iodir = I2C.Message(bytes(self.size), read=True)
+            olat = I2C.Message(bytes(self.size), read=True)
+            bus.transfer(
+                self.address,
+                [
+                    I2C.Message([self.REG_IODIR]),
+                    iodir,
+                    I2C.Message([self.REG_OLAT]),
+                    olat,
+                ],
+            )
+            self.direction = self.from_bytes(iodir.data)
+            self.output = self.from_bytes(olat.data)
+        messages = []
+        if mask & self.direction:
+            self.direction &= ~mask
+            data = self.to_bytes(self.direction)
+            messages.append(I2C.Message([self.REG_IODIR, *data]))
+        if mask:
+            self.output = (self.output & ~mask) | (value & mask)
+            data = self.to_bytes(self.output)
+            messages.append(I2C.Message([self.REG_OLAT, *data]))
+        if read:
+            messages.append(I2C.Message([self.REG_GPIO]))
+            messages.append(I2C.Message(bytes(self.size), read=True))
+        if messages:
+            bus.transfer(self.address, messages)
+        if read:
+            self.input = self.from_bytes(messages[-1].data)
+
+
+class Sr74hc595(BusDevice):
+    NAME = "74HC595 (SPI, 8-bit, chainable)"
+    BUS = SPI
+
+    def transact(self, bus: SPI, mask: int, value: int, read: bool) -> None:
+        if self.output is None:
+            self.output = 0
+        if mask:
+            self.output = (self.output & ~mask) | (value & mask)
+            # the first byte shifted out ends up in the last register
+            bus.transfer(bytes(reversed(self.to_bytes(self.output))))
+        if read:
+            # write-only device - report the latched outputs
+            self.input = self.output
+
+
+BUS_DEVICES: dict[str, type[BusDevice]] = {
+    "pcf8574": Pcf8574,
+    "pcf8575": Pcf8575,
+    "mcp23017": Mcp23017,
+    "74hc595": Sr74hc595,
+}
+
+
+class BusBatch:
+    def __init__(self):
+        self.event = Event()
+        self.errors: dict[BusDevice, Exception] = {}
+
+
+class BusScheduler:
+    def __init__(self, path: str):
+        self.path = path
+        self.bus: I2C | SPI | None = None
+        self.devices: dict[tuple[str, int], BusDevice] = {}
+        self.users: set[int] = set()
+        # device -> [mask, value, read]
+        self.pending: dict[BusDevice, list] = {}
+        self.batch = BusBatch()
+        self.cond = Condition()
+        self.stopped = False
+        self.thread = Thread(target=self._run, name=f"bus {path}", daemon=True)
+        self.thread.start()
+
+    def device(self, chip: str, address: int, count: int) -> BusDevice:
+        device_cls = BUS_DEVICES[chip]
+        if (device_cls.BUS is SPI) != ("spidev" in self.path):
+            raise HomeAssistantError(f"{device_cls.NAME} can't be used on {self.path}")
+        if device_cls.BUS is SPI:
+            # one chain per chip select, the address is meaningless
+            address = 0
+        with self.cond:
+            key = chip, address
+            if key not in self.devices:
+                self.devices[key] = device_cls(address, count)
+            device = self.devices[key]
+            if device_cls.BUS is SPI and device.count != count:
+                raise HomeAssistantError(
+                    f"{device_cls.NAME} on {self.path} is already configured "
+                    f"with {device.count} chained registers, not {count}"
+                )
+            return device
+
+    def write(self, device: BusDevice, mask: int, value: int) -> None:
+        with self.cond:
+            request = self.pending.setdefault(device, [0, 0, False])
+            request[0] |= mask
+            request[1] = (request[1] & ~mask) | (value & mask)
+            batch = self.batch
+            self.cond.notify_all()
+        self._wait(device, batch)
+
+    def read(self, device: BusDevice) -> int:
+        with self.cond:
+            request = self.pending.setdefault(device, [0, 0, False])
+            request[2] = True
+            batch = self.batch
+            self.cond.notify_all()
+        self._wait(device, batch)
+        return device.input
+
+    def stop(self) -> None:
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    @staticmethod
+    def _wait(device: BusDevice, batch: BusBatch) -> None:
+        if not batch.event.wait(timeout=2.0):
+            raise HomeAssistantError("Timeout while waiting for bus transaction")
+        if device in batch.errors:
+            error = batch.errors[device]
+            raise HomeAssistantError(f"Bus transaction failed: {error}") from error
+
+    def _open(self) -> I2C | SPI:
+        if "spidev" in self.path:
+            return SPI(self.path, BUS_SPI_MODE, BUS_SPI_SPEED)
+        return I2C(self.path)
+
+    def _run(self) -> None:
+        while True:
+            with self.cond:
+                while not self.pending and not self.stopped:
+                    self.cond.wait()
+                if self.stopped and not self.pending:
+                    break
+            # let concurrent requests join this transaction
+            sleep(BUS_COALESCE_TIME)
+            with self.cond:
+                batch, self.batch = self.batch, BusBatch()
+                pending, self.pending = self.pending, {}
+            for device, (mask, value, read) in pending.items():
+                try:
+                    if self.bus is None:
+                        self.bus = self._open()
+                    device.transact(self.bus, mask, value, read)
+                except Exception as e:
+                    _LOGGER.error(f"Bus transaction on {self.path} failed: {e}")
+                    batch.errors[device] = e
+            batch.event.set()
+        if self.bus is not None:
+            self.bus.close()
+            self.bus = None
+
+
+class BusMixin:
+    data: dict
+    hass_data: dict
+
+    @staticmethod
+    def get_config_schema():
+        return vol.Schema(
+            {
+                vol.Optional("label_bus"): ConstantSelector(
+                    dict(
+                        label="I²C/SPI bus",
+                        value=True,
+                    ),
+                ),
+                vol.Required("bus"): SelectSelector(
+                    dict(
+                        mode=SelectSelectorMode.DROPDOWN,
+                        options=[
+                            str(path)
+                            for pattern in ["i2c-*", "spidev*"]
+                            for path in Path("/dev").glob(pattern)
+                        ],
+                    ),
+                ),
+                vol.Optional("label_chip"): ConstantSelector(
+                    dict(
+                        label="Chip type",
+                        value=True,
+                    ),
+                ),
+                vol.Required("chip"): SelectSelector(
+                    dict(
+                        mode=SelectSelectorMode.DROPDOWN,
+                        options=[
+                            dict(value=key, label=device.NAME)
+                            for key, device in BUS_DEVICES.items()
+                        ],
+                    ),
+                ),
+                vol.Optional("label_address"): ConstantSelector(
+                    dict(
+                        label="I²C address (ignored for SPI)",
+                        value=True,
+                    ),
+                ),
+                vol.Required("address"): SelectSelector(
+                    dict(
+                        mode=SelectSelectorMode.DROPDOWN,
+                        options=[
+                            dict(value=str(i), label=f"0x{i:02X}")
+                            for i in range(0x03, 0x78)
+                        ],
+                    ),
+                ),
+                vol.Optional("label_count"): ConstantSelector(
+                    dict(
+                        label="Chained shift registers (ignored for I²C)",
+                        value=True,
+                    ),
+                ),
+                vol.Required("count"): SelectSelector(
+                    dict(
+                        mode=SelectSelectorMode.DROPDOWN,
+                        options=[
+                            dict(value=str(i), label=f"{i}") for i in range(1, 33)
+                        ],
+                    ),
+                ),
+                vol.Optional("label_pin"): ConstantSelector(
+                    dict(
+                        label="Pin",
+                        value=True,
+                    ),
+                ),
+                vol.Required("pin"): SelectSelector(
+                    dict(
+                        mode=SelectSelectorMode.DROPDOWN,
+                        options=[
+                            dict(value=str(i), label=f"{i}") for i in range(0, 256)
+                        ],
+                    ),
+                ),
+            }
+        )
+
+    @property
+    def _bus_key(self) -> str:
+        return f"{self.data['bus']}"
+
+    @property
+    def _bus_mask(self) -> int:
+        return 1 << int(self.data["pin"])
+
+    def _bus_get(self) -> tuple[BusScheduler, BusDevice]:
+        with BUS_LOCK:
+            if self._bus_key in self.hass_data:
+                scheduler = self.hass_data[self._bus_key]
+            else:
+                scheduler = BusScheduler(self.data["bus"])
+                self.hass_data[self._bus_key] = scheduler
+            try:
+                device = scheduler.device(
+                    chip=self.data["chip"],
+                    address=int(self.data["address"]),
+                    count=int(self.data.get("count", 1)),
+                )
+            except Exception:
+                if not scheduler.users:
+                    scheduler.stop()
+                    del self.hass_data[self._bus_key]
+                raise
+            scheduler.users.add(id(self))
+        if self._bus_mask >> (device.size * 8):
+            raise HomeAssistantError(f"Pin {self.data['pin']} is out of range")
+        return scheduler, device
+
+    def _bus_release(self) -> None:
+        with BUS_LOCK:
+            if self._bus_key not in self.hass_data:
+                return
+            scheduler: BusScheduler = self.hass_data[self._bus_key]
+            scheduler.users.discard(id(self))
+            if not scheduler.users:
+                scheduler.stop()
+                del self.hass_data[self._bus_key]
+
+    def _bus_write(self, value: bool) -> None:
+        scheduler, device = self._bus_get()
+        scheduler.write(device, self._bus_mask, self._bus_mask if value else 0)
+
+    def _bus_read(self) -> bool:
+        scheduler, device = self._bus_get()
+        return bool(scheduler.read(device) & self._bus_mask)
@@ -21,6 +21,10 @@ class EntityMixin(Entity):
     def get_config_schema() -> vol.Schema:
         raise NotImplementedError()
 
+    @staticmethod
+    def validate_config(data: dict) -> dict:
+        return data
+
 
 class EntityModule:
     TITLE: str
@@ -1,24 +1,44 @@
 #  Copyright (c) Kuba Szczodrzyński 2023-12-30.
 
 import logging
+import platform
+import socket
+from copy import deepcopy
 from pathlib import Path
+from statistics import mean
 from threading import Lock
-from time import time
+from time import perf_counter, time
 
 import voluptuous as vol
+from homeassistant.core import HomeAssistant
 from homeassistant.exceptions import HomeAssistantError
 from homeassistant.helpers.selector import (
     ConstantSelector,
     SelectSelector,
     SelectSelectorMode,
 )
+from homeassistant.helpers.storage import Store
 from periphery import GPIO
 
 _LOGGER = logging.getLogger(__name__)
 
+GPIO_CALIBRATION_KEY = "gpio/calibration"
+GPIO_CALIBRATION_STORE_KEY = "gpio/calibration/store"
+# results of the last timed write of each line, not persisted
+GPIO_TIMING_KEY = "gpio/timing"
+GPIO_CALIBRATION_PULSES = 100
+GPIO_CALIBRATION_PULSE_US = 200
+# calibrations older than that, or from another kernel, are not used
+GPIO_CALIBRATION_MAX_AGE = 30 * 24 * 3600
+# used until the chip is calibrated with a loopback line
+GPIO_DEFAULT_COMPENSATION_US = 15
+# entities and multi-channel writes may request the same line concurrently
+GPIO_OPEN_LOCK = Lock()
+
 
 class GpioMixin:
     data: dict
+    hass: HomeAssistant
     hass_data: dict
 
     @staticmethod
@@ -51,20 +71,75 @@ class GpioMixin:
                         ],
                     ),
                 ),
+                vol.Optional("label_gpioline_loopback"): ConstantSelector(
+                    dict(
+                        label="Loopback input line (for timing calibration)",
+                        value=True,
+                    ),
+                ),
+                vol.Optional("gpioline_loopback", default="-"): SelectSelector(
+                    dict(
+                        mode=SelectSelectorMode.DROPDOWN,
+                        options=[dict(value="-", label="-")]
+                        + [dict(value=str(i), label=f"{i}") for i in range(0, 512)],
+                    ),
+                ),
             }
         )
 
+    @staticmethod
+    async def async_load_calibration(hass: HomeAssistant) -> None:
+        hass_data = hass.data.setdefault("virtual_devices", {})
+        if GPIO_CALIBRATION_STORE_KEY in hass_data:
+            return
+        store = Store(hass, 1, "virtual_devices.gpio_calibration")
+        hass_data[GPIO_CALIBRATION_STORE_KEY] = store
+        hass_data[GPIO_CALIBRATION_KEY] = await store.async_load() or {}
+
+    @staticmethod
+    def async_save_calibration(
+        hass: HomeAssistant,
+        gpiochip: str,
+        calibration: dict,
+    ) -> None:
+        # only modified in the event loop, and saved as a copy
+        hass_data = hass.data.setdefault("virtual_devices", {})
+        data = hass_data.setdefault(GPIO_CALIBRATION_KEY, {})
+        data.setdefault(socket.gethostname(), {})[gpiochip] = calibration
+        store: Store | None = hass_data.get(GPIO_CALIBRATION_STORE_KEY, None)
+        if store:
+            store.async_delay_save(lambda: deepcopy(data), 1.0)
+
     @property
     def _gpio_key(self) -> str:
         return f"{self.data['gpiochip']}/{self.data['gpioline']}"
 
-    def _gpio_get(self) -> tuple[GPIO, Lock]:
-        if self._gpio_key in self.hass_data:
-            gpio, lock = self.hass_data[self._gpio_key]
-        else:
-            gpio = GPIO(self.data["gpiochip"], int(self.data["gpioline"]), "out")
-            lock = Lock()
-            self.hass_data[self._gpio_key] = gpio, lock
+    @property
+    def _gpio_calibration(self) -> dict | None:
+        return self._gpio_get_calibration(self.data["gpiochip"])
+
+    def _gpio_get_calibration(self, gpiochip: str) -> dict | None:
+        calibration = self.hass_data.get(GPIO_CALIBRATION_KEY, None) or {}
+        calibration = calibration.get(socket.gethostname(), None) or {}
+        calibration = calibration.get(gpiochip, None)
+        if not calibration:
+            return None
+        if calibration.get("kernel", None) != platform.release():
+            return None
+        if time() - calibration.get("timestamp", 0) > GPIO_CALIBRATION_MAX_AGE:
+            return None
+        return calibration
+
+    def _gpio_get(self, key: str | None = None) -> tuple[GPIO, Lock]:
+        key = key or self._gpio_key
+        with GPIO_OPEN_LOCK:
+            if key in self.hass_data:
+                gpio, lock = self.hass_data[key]
+            else:
+                gpiochip, _, gpioline = key.rpartition("/")
+                gpio = GPIO(gpiochip, int(gpioline), "out")
+                lock = Lock()
+                self.hass_data[key] = gpio, lock
         return gpio, lock
 
     def _gpio_write(self, value: bool) -> None:
@@ -76,31 +151,203 @@ class GpioMixin:
         finally:
             lock.release()
 
+    @staticmethod
+    def _gpio_run_timed(
+        gpio: GPIO,
+        timing_data: list[tuple[bool, float]],
+        loopback: GPIO | None = None,
+    ) -> list[float]:
+        # return timestamps of all edges, plus the end of the last pulse
+        edges = []
+        tm = perf_counter()
+        for level, duration in timing_data:
+            end = tm + duration
+            gpio.write(value=level)
+            if loopback:
+                while loopback.read() != level:
+                    if perf_counter() > end:
+                        raise HomeAssistantError(
+                            "Loopback line doesn't follow the output line"
+                        )
+                edges.append(perf_counter())
+            else:
+                edges.append(tm)
+            while end > (tm := perf_counter()):
+                pass
+        edges.append(tm)
+        return edges
+
+    @staticmethod
+    def _gpio_timing_error(timing: list[int], edges: list[float]) -> list[float]:
+        return [
+            (end - start) * 1e6 - abs(micros)
+            for micros, start, end in zip(timing, edges, edges[1:])
+        ]
+
+    def _gpio_calibrate(self) -> dict:
+        # opening the line here would drive it low, and race with its entity
+        if self._gpio_key not in self.hass_data:
+            raise HomeAssistantError(f"GPIO line {self._gpio_key} is not open")
+        # with a loopback line, the output toggles for a few dozen milliseconds
+        gpio, lock = self._gpio_get()
+        if not lock.acquire(timeout=2.0):
+            raise HomeAssistantError("Timeout while acquiring lock")
+        loopback = None
+        try:
+            if self.data.get("gpioline_loopback", "-") != "-":
+                loopback = GPIO(
+                    self.data["gpiochip"],
+                    int(self.data["gpioline_loopback"]),
+                    "in",
+                )
+            level = gpio.read()
+            if loopback:
+                # measure real edges on the input line - the output will toggle
+                timing = [
+                    GPIO_CALIBRATION_PULSE_US * (1 if i % 2 else -1)
+                    for i in range(GPIO_CALIBRATION_PULSES)
+                ]
+            else:
+                # measure the loop itself - keep the output level unchanged
+                timing = [
+                    GPIO_CALIBRATION_PULSE_US * (1 if level else -1)
+                    for _ in range(GPIO_CALIBRATION_PULSES)
+                ]
+
+            # gpio.write() latency, without changing the level
+            start = perf_counter()
+            for _ in range(GPIO_CALIBRATION_PULSES):
+                gpio.write(value=level)
+            write_us = (perf_counter() - start) / GPIO_CALIBRATION_PULSES * 1e6
+
+            # uncompensated pulse widths
+            timing_data = [(micros >= 0, abs(micros) / 1e6) for micros in timing]
+            edges = self._gpio_run_timed(gpio, timing_data, loopback)
+            # the last pulse doesn't end with an edge
+            errors = self._gpio_timing_error(timing, edges)[:-1]
+
+            if loopback:
+                compensation_us = max(0.0, mean(errors))
+                # verify the compensated pulse widths
+                timing_data = [
+                    (level, max(0.0, duration - compensation_us / 1e6))
+                    for level, duration in timing_data
+                ]
+                edges = self._gpio_run_timed(gpio, timing_data, loopback)
+                errors = self._gpio_timing_error(timing, edges)[:-1]
+            gpio.write(value=level)
+        finally:
+            lock.release()
+            if loopback:
+                loopback.close()
+
+        calibration = dict(
+            timestamp=time(),
+            kernel=platform.release(),
+            loopback=loopback is not None,
+            write_us=write_us,
+        )
+        if loopback:
+            # widths of the pulses seen on the input line
+            calibration["compensation_us"] = compensation_us
+            calibration["error_us"] = mean(errors)
+            calibration["max_error_us"] = max(abs(error) for error in errors)
+        else:
+            # the loop compared to its own timestamps - this is only its jitter,
+            # the latency between gpio.write() and the edge can't be observed,
+            # so the default compensation stays in use
+            calibration["loop_error_us"] = mean(errors)
+            calibration["loop_max_error_us"] = max(abs(error) for error in errors)
+        _LOGGER.info(
+            f"Calibrated GPIO timing of {self.data['gpiochip']}: {calibration}"
+        )
+        return calibration
+
     def _gpio_write_timed(self, timing: list[int]) -> None:
+        calibration = self._gpio_calibration or {}
+        compensation_us = calibration.get(
+            "compensation_us",
+            GPIO_DEFAULT_COMPENSATION_US,
+        )
         gpio, lock = self._gpio_get()
         if not lock.acquire(timeout=2.0):
             raise HomeAssistantError("Timeout while acquiring lock")
         timing_data = [
             (
                 micros >= 0,
-                (abs(micros) / 1e6) - (15 / 1e6),
-                (abs(micros) / 1e6),
+                max(0.0, (abs(micros) - compensation_us) / 1e6),
             )
             for micros in timing
         ]
         try:
-            # time_start = time()
-            tm = time()
-            for level, duration, _ in timing_data:
-                end = tm + duration
-                gpio.write(value=level)
-                while end > (tm := time()):
-                    pass
-            # time_end = time()
-            # _LOGGER.error(
-            #     f"GPIO write timing: "
-            #     f"elapsed={(time_end - time_start) * 1e3:.03f} ms, "
-            #     f"expected={sum(d for _, _, d in timing_data) * 1e3:.03f} ms"
-            # )
+            edges = self._gpio_run_timed(gpio, timing_data)
         finally:
             lock.release()
+        # no loopback here - this is the loop's jitter, not the real pulse widths
+        errors = self._gpio_timing_error(timing, edges)
+        if errors:
+            self.hass_data.setdefault(GPIO_TIMING_KEY, {})[self._gpio_key] = dict(
+                timestamp=time(),
+                compensation_us=compensation_us,
+                loop_error_us=mean(errors),
+                loop_max_error_us=max(abs(error) for error in errors),
+            )
+
+    def _gpio_write_timed_multi(self, waveforms: dict[str, list[int]]) -> None:
+        # waveforms are keyed by "gpiochip/gpioline", like _gpio_key
+        # lines are registered like in _gpio_get(), so that they keep holding
+        # the final level - the entities owning them close them when removed
+        channels = {key: self._gpio_get(key) for key in sorted(waveforms)}
+
+        # merge all waveforms into one timeline of simultaneous writes
+        timeline: dict[int, list[tuple[str, GPIO, bool]]] = {}
+        end = 0
+        for key, timing in waveforms.items():
+            gpio, _ = channels[key]
+            gpiochip = key.rpartition("/")[0]
+            tm = 0
+            for micros in timing:
+                timeline.setdefault(tm, []).append((gpiochip, gpio, micros >= 0))
+                tm += abs(micros)
+            end = max(end, tm)
+
+        # center each group of writes on its edge time, using write latency;
+        # chips that aren't calibrated (see _gpio_calibrate()) aren't measured
+        # here, as that would toggle the outputs - their writes count as
+        # instant, so such groups start on the edge time and end slightly late
+        events = []
+        for tm in sorted(timeline):
+            # keep writes to lines of the same chip next to each other
+            writes = sorted(timeline[tm], key=lambda write: write[0])
+            offset = 0.0
+            for gpiochip, _, _ in writes:
+                calibration = self._gpio_get_calibration(gpiochip) or {}
+                offset += calibration.get("write_us", 0.0) / 2
+            events.append(
+                (
+                    tm / 1e6 - offset / 1e6,
+                    [(gpio, level) for _, gpio, level in writes],
+                )
+            )
+        lead = max(0.0, -min((tm for tm, _ in events), default=0.0))
+
+        # lock all lines in a fixed order, to avoid deadlocks
+        locked = []
+        try:
+            for _, lock in channels.values():
+                if not lock.acquire(timeout=2.0):
+                    raise HomeAssistantError("Timeout while acquiring lock")
+                locked.append(lock)
+            start = perf_counter() + lead
+            for tm, writes in events:
+                deadline = start + tm
+                while deadline > perf_counter():
+                    pass
+                for gpio, level in writes:
+                    gpio.write(value=level)
+            deadline = start + end / 1e6
+            while deadline > perf_counter():
+                pass
+        finally:
+            for lock in locked:
+                lock.release()
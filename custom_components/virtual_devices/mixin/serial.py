@@ -0,0 +1,245 @@
+#  Copyright (c) Kuba Szczodrzyński 2024-1-18.
+
+import asyncio
+import logging
+from pathlib import Path
+from typing import Callable
+
+import voluptuous as vol
+from homeassistant.core import HomeAssistant
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers.selector import (
+    ConstantSelector,
+    SelectSelector,
+    SelectSelectorMode,
+)
+from periphery import Serial
+
+_LOGGER = logging.getLogger(__name__)
+
+SERIAL_BAUDRATES = [1200, 2400, 4800, 9600, 19200, 38400, 57600, 115200]
+SERIAL_PORTS = ["ttyS*", "ttyUSB*", "ttyACM*", "ttyAMA*"]
+SERIAL_READ_SIZE = 4096
+SERIAL_TIMEOUT = 2.0
+
+
+class SerialRequest:
+    def __init__(self, match: Callable[[bytes], bool]):
+        self.match = match
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class SerialConnection:
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        path: str,
+        baudrate: int,
+        delimiter: bytes | None,
+    ):
+        self.hass = hass
+        self.path = path
+        self.baudrate = baudrate
+        # frames are either delimited, or separated by an idle gap
+        self.delimiter = delimiter
+        self.gap = max(0.002, 35 / baudrate)
+        self.serial: Serial | None = None
+        self.buffer = bytearray()
+        self.gap_handle: asyncio.TimerHandle | None = None
+        self.requests: list[SerialRequest] = []
+        self.listeners: dict[int, Callable[[bytes], None]] = {}
+        self.lock = asyncio.Lock()
+        self.write_lock = asyncio.Lock()
+
+    async def open(self) -> None:
+        async with self.lock:
+            if self.serial is not None:
+                return
+            self.serial = await self.hass.async_add_executor_job(
+                Serial,
+                self.path,
+                self.baudrate,
+            )
+            self.hass.loop.add_reader(self.serial.fd, self._on_readable)
+
+    async def close(self) -> None:
+        # wait for a pending open(), so that the port it opens doesn't leak
+        async with self.lock:
+            if self.gap_handle:
+                self.gap_handle.cancel()
+                self.gap_handle = None
+            for request in self.requests:
+                if not request.future.done():
+                    request.future.set_exception(
+                        HomeAssistantError(f"Serial port {self.path} was closed")
+                    )
+            self.requests.clear()
+            if self.serial is None:
+                return
+            self.hass.loop.remove_reader(self.serial.fd)
+            self.serial.close()
+            self.serial = None
+
+    async def request(
+        self,
+        data: bytes,
+        match: Callable[[bytes], bool] | None = None,
+        timeout: float = SERIAL_TIMEOUT,
+    ) -> bytes | None:
+        if self.serial is None:
+            raise HomeAssistantError(f"Serial port {self.path} is not open")
+        request = None
+        if match:
+            # register before writing, in case the response comes quickly
+            request = SerialRequest(match)
+            self.requests.append(request)
+        try:
+            # keep frames from interleaving, without blocking the event loop
+            async with self.write_lock:
+                await self.hass.async_add_executor_job(self.serial.write, data)
+        except Exception:
+            if request:
+                self.requests.remove(request)
+            raise
+        if not request:
+            return None
+        try:
+            return await asyncio.wait_for(request.future, timeout)
+        except asyncio.TimeoutError:
+            raise HomeAssistantError(
+                f"Timeout while waiting for response on {self.path}"
+            )
+        finally:
+            if request in self.requests:
+                self.requests.remove(request)
+
+    def _on_readable(self) -> None:
+        try:
+            data = self.serial.read(SERIAL_READ_SIZE, 0)
+        except Exception as e:
+            _LOGGER.error(f"Couldn't read from {self.path}: {e}")
+            return
+        self.buffer += data
+        if self.delimiter is None:
+            if self.gap_handle:
+                self.gap_handle.cancel()
+            self.gap_handle = self.hass.loop.call_later(self.gap, self._on_gap)
+            return
+        *frames, rest = self.buffer.split(self.delimiter)
+        self.buffer = bytearray(rest)
+        for frame in frames:
+            self._dispatch(bytes(frame))
+
+    def _on_gap(self) -> None:
+        self.gap_handle = None
+        frame, self.buffer = bytes(self.buffer), bytearray()
+        self._dispatch(frame)
+
+    def _dispatch(self, frame: bytes) -> None:
+        if not frame:
+            return
+        # responses are matched to the oldest pending request first
+        for request in self.requests:
+            if not request.future.done() and request.match(frame):
+                request.future.set_result(frame)
+                self.requests.remove(request)
+                return
+        for listener in list(self.listeners.values()):
+            try:
+                listener(frame)
+            except Exception as e:
+                _LOGGER.error(f"Serial frame listener failed: {e}")
+
+
+class SerialMixin:
+    data: dict
+    hass: HomeAssistant
+    hass_data: dict
+
+    @staticmethod
+    def get_config_schema():
+        return vol.Schema(
+            {
+                vol.Optional("label_port"): ConstantSelector(
+                    dict(
+                        label="Serial port",
+                        value=True,
+                    ),
+                ),
+                vol.Required("port"): SelectSelector(
+                    dict(
+                        mode=SelectSelectorMode.DROPDOWN,
+                        options=[
+                            str(path)
+                            for pattern in SERIAL_PORTS
+                            for path in Path("/dev").glob(pattern)
+                        ],
+                        custom_value=True,
+                    ),
+                ),
+                vol.Optional("label_baudrate"): ConstantSelector(
+                    dict(
+                        label="Baud rate",
+                        value=True,
+                    ),
+                ),
+                vol.Required("baudrate"): SelectSelector(
+                    dict(
+                        mode=SelectSelectorMode.DROPDOWN,
+                        options=[str(i) for i in SERIAL_BAUDRATES],
+                    ),
+                ),
+            }
+        )
+
+    @property
+    def _serial_key(self) -> str:
+        return f"{self.data['port']}"
+
+    @property
+    def _serial_delimiter(self) -> bytes | None:
+        return b"\n"
+
+    async def _serial_open(self) -> SerialConnection:
+        if self._serial_key in self.hass_data:
+            connection = self.hass_data[self._serial_key]
+        else:
+            connection = SerialConnection(
+                hass=self.hass,
+                path=self.data["port"],
+                baudrate=int(self.data["baudrate"]),
+                delimiter=self._serial_delimiter,
+            )
+            self.hass_data[self._serial_key] = connection
+        baudrate = int(self.data["baudrate"])
+        delimiter = self._serial_delimiter
+        if connection.baudrate != baudrate or connection.delimiter != delimiter:
+            raise HomeAssistantError(
+                f"Serial port {connection.path} is already used with different "
+                f"settings (baud rate {connection.baudrate}, "
+                f"delimiter {connection.delimiter!r})"
+            )
+        connection.listeners[id(self)] = self._serial_received
+        await connection.open()
+        return connection
+
+    async def _serial_close(self) -> None:
+        if self._serial_key not in self.hass_data:
+            return
+        connection: SerialConnection = self.hass_data[self._serial_key]
+        connection.listeners.pop(id(self), None)
+        if not connection.listeners:
+            del self.hass_data[self._serial_key]
+            await connection.close()
+
+    async def _serial_request(
+        self,
+        data: bytes,
+        match: Callable[[bytes], bool] | None = None,
+        timeout: float = SERIAL_TIMEOUT,
+    ) -> bytes | None:
+        connection = await self._serial_open()
+        return await connection.request(data, match, timeout)
+
+    def _serial_received(self, frame: bytes) -> None:
+        pass
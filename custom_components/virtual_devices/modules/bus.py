@@ -0,0 +1,52 @@
+#  Copyright (c) Kuba Szczodrzyński 2024-1-16.
+
+import voluptuous as vol
+from homeassistant.components.binary_sensor import BinarySensorEntity
+from homeassistant.components.switch import SwitchEntity
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import Platform
+
+from custom_components.virtual_devices import VirtualEntity
+from custom_components.virtual_devices.mixin.bus import BusMixin
+
+TITLE = "I²C/SPI Port Expander"
+DESCRIPTION = ""
+
+
+class BusSwitch(SwitchEntity, VirtualEntity, BusMixin):
+    def __init__(self, config_entry: ConfigEntry, data: dict):
+        super().__init__(config_entry, data)
+        self._attr_is_on = False
+
+    @staticmethod
+    def get_config_schema() -> vol.Schema:
+        return BusMixin.get_config_schema()
+
+    async def async_will_remove_from_hass(self) -> None:
+        self._bus_release()
+
+    def turn_on(self, **kwargs) -> None:
+        self._bus_write(True)
+        self._attr_is_on = True
+
+    def turn_off(self, **kwargs) -> None:
+        self._bus_write(False)
+        self._attr_is_on = False
+
+
+class BusBinarySensor(BinarySensorEntity, VirtualEntity, BusMixin):
+    @staticmethod
+    def get_config_schema() -> vol.Schema:
+        return BusMixin.get_config_schema()
+
+    async def async_will_remove_from_hass(self) -> None:
+        self._bus_release()
+
+    def update(self) -> None:
+        self._attr_is_on = self._bus_read()
+
+
+PLATFORMS = {
+    Platform.SWITCH: BusSwitch,
+    Platform.BINARY_SENSOR: BusBinarySensor,
+}
@@ -0,0 +1,176 @@
+#  Copyright (c) Kuba Szczodrzyński 2024-1-18.
+
+import logging
+
+import homeassistant.helpers.config_validation as cv
+import voluptuous as vol
+from homeassistant.components.switch import SwitchEntity
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import Platform
+from homeassistant.helpers.selector import SelectSelector, SelectSelectorMode
+
+from custom_components.virtual_devices import VirtualEntity
+from custom_components.virtual_devices.mixin.serial import SerialMixin
+
+_LOGGER = logging.getLogger(__name__)
+
+TITLE = "Serial Port Commands"
+DESCRIPTION = ""
+
+COMMAND_KEYS = [
+    "on_command",
+    "off_command",
+    "response",
+    "query_command",
+    "on_state",
+    "off_state",
+]
+
+LINE_ENDINGS = {
+    "lf": "\n",
+    "crlf": "\r\n",
+    "cr": "\r",
+}
+
+
+class SerialSwitch(SwitchEntity, VirtualEntity, SerialMixin):
+    def __init__(self, config_entry: ConfigEntry, data: dict):
+        super().__init__(config_entry, data)
+        self._attr_is_on = False
+
+    @staticmethod
+    def get_config_schema() -> vol.Schema:
+        return SerialMixin.get_config_schema().extend(
+            {
+                vol.Required("format", default="text"): SelectSelector(
+                    dict(
+                        mode=SelectSelectorMode.DROPDOWN,
+                        options=[
+                            dict(value="text", label="Text lines"),
+                            dict(value="hex", label="Binary frames (hex)"),
+                        ],
+                    ),
+                ),
+                vol.Required("line_ending", default="crlf"): SelectSelector(
+                    dict(
+                        mode=SelectSelectorMode.DROPDOWN,
+                        options=[
+                            dict(value=key, label=key.upper()) for key in LINE_ENDINGS
+                        ],
+                    ),
+                ),
+                vol.Required("on_command"): cv.string,
+                vol.Required("off_command"): cv.string,
+                vol.Optional("response", default=""): cv.string,
+                vol.Optional("query_command", default=""): cv.string,
+                vol.Optional("on_state", default=""): cv.string,
+                vol.Optional("off_state", default=""): cv.string,
+            }
+        )
+
+    @staticmethod
+    def validate_config(data: dict) -> dict:
+        if data.get("query_command", None):
+            if not data.get("on_state", None) and not data.get("off_state", None):
+                raise vol.Invalid(
+                    "Polling with a query command needs an ON or OFF state",
+                    ["query_command"],
+                )
+        if data.get("format", None) != "hex":
+            return data
+        for key in COMMAND_KEYS:
+            try:
+                bytes.fromhex(data.get(key, None) or "")
+            except ValueError:
+                raise vol.Invalid(f"'{data[key]}' is not a valid hex string", [key])
+        return data
+
+    @property
+    def should_poll(self) -> bool:
+        return bool(self.data.get("query_command", None))
+
+    @property
+    def _serial_hex(self) -> bool:
+        return self.data.get("format", None) == "hex"
+
+    @property
+    def _serial_delimiter(self) -> bytes | None:
+        if self._serial_hex:
+            return None
+        return LINE_ENDINGS[self.data.get("line_ending", "crlf")][-1:].encode()
+
+    def _encode(self, command: str) -> bytes:
+        if self._serial_hex:
+            return bytes.fromhex(command)
+        return (command + LINE_ENDINGS[self.data.get("line_ending", "crlf")]).encode()
+
+    def _decode(self, frame: bytes) -> str:
+        if self._serial_hex:
+            return frame.hex().upper()
+        return frame.decode(errors="replace").strip()
+
+    def _normalize(self, value: str) -> str:
+        if self._serial_hex:
+            return value.replace(" ", "").upper()
+        return value.strip()
+
+    def _match_state(self, frame: bytes) -> bool | None:
+        frame = self._decode(frame)
+        on_state = self._normalize(self.data.get("on_state", None) or "")
+        off_state = self._normalize(self.data.get("off_state", None) or "")
+        if on_state and frame.startswith(on_state):
+            return True
+        if off_state and frame.startswith(off_state):
+            return False
+        return None
+
+    async def async_added_to_hass(self) -> None:
+        await super().async_added_to_hass()
+        try:
+            await self._serial_open()
+        except Exception as e:
+            # the port will be opened again with the next request
+            _LOGGER.warning(f"Couldn't open serial port {self.data['port']}: {e}")
+
+    async def async_will_remove_from_hass(self) -> None:
+        await self._serial_close()
+
+    async def _async_send(self, command: str) -> None:
+        response = self._normalize(self.data.get("response", None) or "")
+        match = None
+        if response:
+
+            def match(frame: bytes) -> bool:
+                return self._decode(frame).startswith(response)
+
+        await self._serial_request(self._encode(command), match)
+
+    async def async_turn_on(self, **kwargs) -> None:
+        await self._async_send(self.data["on_command"])
+        self._attr_is_on = True
+
+    async def async_turn_off(self, **kwargs) -> None:
+        await self._async_send(self.data["off_command"])
+        self._attr_is_on = False
+
+    async def async_update(self) -> None:
+        query = self.data.get("query_command", None)
+        if not query:
+            return
+        frame = await self._serial_request(
+            self._encode(query),
+            lambda f: self._match_state(f) is not None,
+        )
+        self._attr_is_on = self._match_state(frame)
+
+    def _serial_received(self, frame: bytes) -> None:
+        state = self._match_state(frame)
+        if state is None:
+            return
+        self._attr_is_on = state
+        self.async_write_ha_state()
+
+
+PLATFORMS = {
+    Platform.SWITCH: SerialSwitch,
+}
@@ -0,0 +1,213 @@
+#  Copyright (c) Kuba Szczodrzyński 2024-1-14.
+
+import logging
+from cProfile import Profile
+from functools import wraps
+from inspect import iscoroutinefunction
+from io import StringIO
+from pstats import Stats
+from threading import Lock
+from time import perf_counter, time
+from typing import Any, Callable
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_DURATION
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.entity import Entity
+
+from .const import CONF_END, CONF_MODULES, CONF_PROFILE, DOMAIN
+
+_LOGGER = logging.getLogger(__name__)
+
+PROFILE_METHODS = [
+    "turn_on",
+    "turn_off",
+    "toggle",
+    "press",
+    "update",
+    "async_turn_on",
+    "async_turn_off",
+    "async_toggle",
+    "async_press",
+    "async_update",
+    "async_added_to_hass",
+    "async_will_remove_from_hass",
+]
+PROFILE_TOP_FUNCTIONS = 30
+# entity modules and the integration itself both live in "virtual_devices" dirs
+PROFILE_ASYNC_FILTER = r"virtual_devices[\\/]"
+# only one deterministic profiler may be active at a time - a second one
+# enabled on the same thread would silently replace the first one's hook
+PROFILE_LOCK = Lock()
+
+
+class IntegrationProfiler:
+    def __init__(self, config_entry: ConfigEntry):
+        config = config_entry.data.get(CONF_PROFILE, None) or {}
+        self.modules: list[str] = config.get(CONF_MODULES, None) or []
+        self.duration = int(config.get(CONF_DURATION, 0))
+        self.end = float(config.get(CONF_END, 0))
+        self.results: dict[str, dict] = {}
+
+    @staticmethod
+    def get(hass: HomeAssistant, config_entry: ConfigEntry) -> "IntegrationProfiler":
+        hass_data = hass.data.setdefault(DOMAIN, {})
+        key = f"profiler/{config_entry.entry_id}"
+        if key not in hass_data:
+            hass_data[key] = IntegrationProfiler(config_entry)
+        return hass_data[key]
+
+    @staticmethod
+    def reset(hass: HomeAssistant, config_entry: ConfigEntry) -> None:
+        hass_data = hass.data.setdefault(DOMAIN, {})
+        key = f"profiler/{config_entry.entry_id}"
+        profiler = IntegrationProfiler(config_entry)
+        current: IntegrationProfiler | None = hass_data.get(key, None)
+        # keep the results if the entry is only reloaded, e.g. by editing entities
+        if current and current.end == profiler.end:
+            if current.modules == profiler.modules:
+                return
+        hass_data[key] = profiler
+
+    @staticmethod
+    def remove(hass: HomeAssistant, config_entry: ConfigEntry) -> None:
+        hass_data = hass.data.setdefault(DOMAIN, {})
+        hass_data.pop(f"profiler/{config_entry.entry_id}", None)
+
+    @property
+    def active(self) -> bool:
+        return time() < self.end
+
+    def is_enabled(self, module_name: str) -> bool:
+        if not self.active:
+            return False
+        return not self.modules or module_name in self.modules
+
+    def run(self, key: str, func: Callable, *args, **kwargs) -> Any:
+        if not self.active:
+            return func(*args, **kwargs)
+        start = perf_counter()
+        profile = self._enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._disable(profile)
+            self._collect(key, profile, perf_counter() - start)
+
+    async def async_run(self, key: str, func: Callable, *args, **kwargs) -> Any:
+        if not self.active:
+            return await func(*args, **kwargs)
+        # the profile also covers other tasks running on the event loop
+        # while the coroutine is suspended - only module frames are reported
+        start = perf_counter()
+        profile = self._enable()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            self._disable(profile)
+            self._collect(key, profile, perf_counter() - start, PROFILE_ASYNC_FILTER)
+
+    @staticmethod
+    def _enable() -> Profile | None:
+        # if no profile can be enabled, only the call's timing is collected
+        if not PROFILE_LOCK.acquire(blocking=False):
+            return None
+        profile = Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler (e.g. HA's profiler integration) is running
+            PROFILE_LOCK.release()
+            return None
+        return profile
+
+    @staticmethod
+    def _disable(profile: Profile | None) -> None:
+        if profile is None:
+            return
+        profile.disable()
+        PROFILE_LOCK.release()
+
+    def wrap_entity(self, module_name: str, entity: Entity) -> None:
+        for name in PROFILE_METHODS:
+            for cls in type(entity).__mro__:
+                if name in cls.__dict__:
+                    break
+            else:
+                continue
+            # skip methods not overridden by the entity module
+            if cls.__module__.startswith("homeassistant."):
+                continue
+            method = getattr(entity, name)
+            setattr(entity, name, self._wrap(f"{module_name}.{name}", method))
+
+    def _wrap(self, key: str, method: Callable) -> Callable:
+        if iscoroutinefunction(method):
+
+            @wraps(method)
+            async def wrapper(*args, **kwargs):
+                return await self.async_run(key, method, *args, **kwargs)
+
+        else:
+
+            @wraps(method)
+            def wrapper(*args, **kwargs):
+                return self.run(key, method, *args, **kwargs)
+
+        return wrapper
+
+    def _collect(
+        self,
+        key: str,
+        profile: Profile | None,
+        elapsed: float,
+        restriction: str | None = None,
+    ) -> None:
+        try:
+            result = self.results.get(key, None)
+            if result is None:
+                result = self.results[key] = dict(
+                    calls=0,
+                    profiled=0,
+                    total=0.0,
+                    min=elapsed,
+                    max=elapsed,
+                    stats=Stats(),
+                    restriction=restriction,
+                )
+            result["calls"] += 1
+            result["total"] += elapsed
+            result["min"] = min(result["min"], elapsed)
+            result["max"] = max(result["max"], elapsed)
+            if profile is not None:
+                result["profiled"] += 1
+                result["stats"].add(profile)
+        except Exception as e:
+            _LOGGER.warning(f"Couldn't collect profile of '{key}': {e}")
+
+    def as_dict(self) -> dict:
+        results = {}
+        for key, result in self.results.items():
+            stream = StringIO()
+            stats: Stats = result["stats"]
+            stats.stream = stream
+            restrictions = [PROFILE_TOP_FUNCTIONS]
+            if result["restriction"]:
+                restrictions.insert(0, result["restriction"])
+            stats.sort_stats("cumulative").print_stats(*restrictions)
+            results[key] = dict(
+                calls=result["calls"],
+                profiled_calls=result["profiled"],
+                total_ms=result["total"] * 1e3,
+                avg_ms=result["total"] / result["calls"] * 1e3,
+                min_ms=result["min"] * 1e3,
+                max_ms=result["max"] * 1e3,
+                profile=stream.getvalue().splitlines(),
+            )
+        return dict(
+            modules=self.modules,
+            duration=self.duration,
+            active=self.active,
+            remaining=max(0.0, self.end - time()),
+            results=results,
+        )